@@ -1,25 +1,54 @@
 import argparse
+import logging
+import multiprocessing
 import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from image_input import crop_detections
-from kmeans_module import analyze_image
+import cv2
+
+from kmeans_module import analyze_image_arr
 from match import preprocess_input, check_variants, get_tile_number
 
+log = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+
+# Below this number of crops the analysis runs in the main process
+PARALLEL_MIN_CROPS = 100
+
+
+def init_worker():
+    # One OpenCV thread per process, the pool already uses every core
+    cv2.setNumThreads(1)
 
-def process_crops(image_dir, base_crop_dir="crops", remove_crop_dir=False):
-    # Process only images starting with the original name of the image
-    original_basename = Path(image_dir).stem
 
-    # List of all recognised tile numbers
-    recognized_tiles = []
+def analyze_and_match(filename, crop, pattern):
+    """Analyze a single cropped tile (BGR array) and match it against the pattern of its class.
+    Returns the detected variant and the tile number."""
+    log.debug("Processing: %s", filename)
+    result, matches = analyze_image_arr(crop)
+    variants = preprocess_input(result)
+    matched_variant = check_variants(variants, input_pattern=pattern)
+    tile_number = get_tile_number(matched_variant)
+    return matched_variant, tile_number
 
-    # Number of un(recognised) tiles
-    num_recognised = 0
-    num_unrecognised = 0
 
+def run_job(job):
+    """Run analyze_and_match for one (filename, crop, pattern) job.
+    Returns (result, None) on success and (None, exception) on failure."""
+    try:
+        return analyze_and_match(*job), None
+    except Exception as e:
+        return None, e
 
+
+def process_crops(crops, base_crop_dir="crops", save_crops=False, remove_crop_dir=False, max_workers=None):
+    """Classify the cropped tiles of all input images, as returned by crop_detections
+    (input image path -> list of (class_name, filename, crop) tuples), and print the results per image.
+    With save_crops, the crops already written to base_crop_dir by crop_detections are renamed
+    to include their tile number."""
     # Foldernames matching the patterns
     pattern_map = {
         "ccc": "abc",
@@ -28,69 +57,105 @@ def process_crops(image_dir, base_crop_dir="crops", remove_crop_dir=False):
         "cxx": "abcbc"
     }
 
-    for folder_name, pattern in pattern_map.items():
-        folder_path = Path(base_crop_dir) / folder_name
-        if not folder_path.exists():
-            print(f"Directory {folder_path} not found, skipping.")
-            continue
-
-        for image_file in folder_path.glob("*.jpg"):
-            if not image_file.stem.startswith(original_basename):
-                continue  # File does not belong to original image
-            print(f"Processing: {image_file}")
-            try:
-                result, matches = analyze_image(str(image_file))
-                variants = preprocess_input(result)
-                matched_variant = check_variants(variants, input_pattern=pattern)
-                tile_number = get_tile_number(matched_variant)
-                print(f"Detected pattern: {matched_variant} → Tile number: {tile_number}")
-
-                 # Extend file name with "_tile_<number>"
+    # Collect the crops of all images together with their pattern
+    jobs = {}
+    crop_paths = {}
+    for image_path, image_crops in crops.items():
+        jobs[image_path] = []
+        for class_name, filename, crop in image_crops:
+            pattern = pattern_map.get(class_name)
+            if pattern is None:
+                print(f"Unknown tile class {class_name}, skipping {filename}.")
+                continue
+            jobs[image_path].append((filename, crop, pattern))
+            crop_paths[filename] = Path(base_crop_dir) / class_name / filename
+    all_jobs = [job for image_jobs in jobs.values() for job in image_jobs]
+
+    # A crop takes only a few milliseconds, starting worker processes only pays off for many crops
+    workers = min(max_workers or os.cpu_count(), len(all_jobs))
+    if workers <= 1 or len(all_jobs) < PARALLEL_MIN_CROPS:
+        outcomes = [run_job(job) for job in all_jobs]
+    else:
+        # One pool for all images. Spawned workers do not inherit the CUDA state
+        # that YOLO set up in the parent process.
+        mp_context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context, initializer=init_worker) as executor:
+            outcomes = list(executor.map(run_job, all_jobs))
+    outcomes = iter(outcomes)
+
+    for image_path, image_jobs in jobs.items():
+        print(f"\n{image_path}:")
+
+        # List of all recognised tile numbers
+        recognized_tiles = []
+
+        # Number of un(recognised) tiles
+        num_recognised = 0
+        num_unrecognised = 0
+
+        for filename, *_ in image_jobs:
+            result, error = next(outcomes)
+            if error is not None:
+                print(f"Error processing {filename}: {error}")
+                continue
+            matched_variant, tile_number = result
+            print(f"Detected pattern: {matched_variant} → Tile number: {tile_number}")
+
+            # Extend file name of the saved crop with "_tile_<number>"
+            if save_crops:
+                crop_path = crop_paths[filename]
                 try:
-                    new_stem = f"{image_file.stem}_tile_{tile_number}"
-                    new_path = image_file.with_name(new_stem + image_file.suffix)
-                    image_file.rename(new_path)
-                    # If successful, update the file path here for possible further processing
-                    image_file = new_path
+                    crop_path.rename(crop_path.with_name(f"{crop_path.stem}_tile_{tile_number}{crop_path.suffix}"))
                 except Exception as rename_err:
                     print(f"Warning: Could not rename file: {rename_err}")
 
-                # Append tile number to list
-                if tile_number is not None:
-                    num_recognised += 1
-                    recognized_tiles.append(tile_number)
-                else:
-                    num_unrecognised += 1
-
-            except Exception as e:
-                print(f"Error processing {image_file}: {e}")
+            # Append tile number to list
+            if tile_number is not None:
+                num_recognised += 1
+                recognized_tiles.append(tile_number)
+            else:
+                num_unrecognised += 1
 
-    # Print all recognised tile numbers
-    print(f"\nUnrecognized tiles: {num_unrecognised}, Recognition ratio: {num_recognised / (num_recognised + num_unrecognised):.2f}")
-    print("\nRecognised Tile Numbers:")
-    print(recognized_tiles)
+        # Print all recognised tile numbers
+        num_total = num_recognised + num_unrecognised
+        print(f"\nUnrecognized tiles: {num_unrecognised}, Recognition ratio: {num_recognised / num_total if num_total else 0:.2f}")
+        print("\nRecognised Tile Numbers:")
+        print(recognized_tiles)
 
-    if remove_crop_dir:
+    if remove_crop_dir and Path(base_crop_dir).exists():
         print(f"Removing crop directory: {base_crop_dir}")
         shutil.rmtree(base_crop_dir, ignore_errors=False)
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("image_path", help="Path to the image, e.g. 'Roboflow/tantrix-extreme.jpg'")
+    parser.add_argument("image_path", help="Path to the image or a directory of images, e.g. 'Roboflow/tantrix-extreme.jpg'")
     parser.add_argument("output_path", help="Path to the cropped images (default: crops)", default="crops")
+    parser.add_argument("--save-crops", "-s", action="store_true", help="Save the cropped images, named after their tile number, to output_path", default=False)
     parser.add_argument("--remove_dir", "-r", action="store_true", help="Remove the folder containing the cropped images after processing", default=False)
     args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    # Imported here, so that the spawned worker processes do not load torch and YOLO
+    from image_input import crop_detections
+
+    # Collect the input images (a single file or all images in a directory)
+    input_path = Path(args.image_path)
+    if input_path.is_dir():
+        image_paths = sorted(str(p) for p in input_path.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    else:
+        image_paths = [str(input_path)]
 
-    # Step 1: Analyse the image and create the crops
-    crop_detections(
+    # Step 1: Analyse the images in batches and create the crops (kept in memory,
+    # with --save-crops they are also written to disk in the background)
+    crops = crop_detections(
         model_path="Roboflow/best.pt",
-        input_image_path=args.image_path,
-        output_dir=args.output_path
+        input_image_paths=image_paths,
+        output_dir=args.output_path if args.save_crops else None
     )
 
-    # Step 2: Process the cropped images
-    process_crops(image_dir=args.image_path, base_crop_dir=args.output_path, remove_crop_dir=args.remove_dir)
+    # Step 2: Process the cropped images of all input images
+    process_crops(crops, base_crop_dir=args.output_path, save_crops=args.save_crops, remove_crop_dir=args.remove_dir)
 
 
 if __name__ == "__main__":
@@ -1,43 +1,113 @@
+import importlib.util
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+
 import cv2
+import torch
 from ultralytics import YOLO
 from pathlib import Path
 from PIL import Image
 
-def crop_detections(model_path, input_image_path, output_dir="crops"):
-    # Load model
-    model = YOLO(model_path)
+def chunks(items, size):
+    """Yield successive chunks of `size` elements from `items`"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+@lru_cache(maxsize=2)
+def _load_model(model_path):
+    """Load the YOLO model once per path and reuse it for later calls"""
+    return YOLO(model_path)
+
+def build_engine(model_path, imgsz=640, batch_size=16):
+    """Export the YOLO weights to a TensorRT FP16 engine, the engine is cached next to the weights.
+    The image size and batch size are part of the file name, so a changed setting builds a new engine.
+    Returns None if TensorRT is not installed or the export fails."""
+    engine_path = Path(model_path).with_name(f"{Path(model_path).stem}_{imgsz}_b{batch_size}.engine")
+    if engine_path.exists():
+        return str(engine_path)
+    # Do not let Ultralytics pip-install TensorRT at runtime
+    if importlib.util.find_spec("tensorrt") is None:
+        print(f"Warning: TensorRT is not installed, using {model_path}")
+        return None
+    try:
+        exported = YOLO(model_path).export(format="engine", half=True, dynamic=True, batch=batch_size, imgsz=imgsz)
+    except Exception as e:
+        print(f"Warning: TensorRT export failed, using {model_path}: {e}")
+        return None
+    Path(exported).replace(engine_path)
+    return str(engine_path)
+
+def crop_detections(model_path, input_image_paths, output_dir=None, batch_size=16, imgsz=640, use_engine=True):
+    """Detect the tiles in all input images and crop them.
+    Returns a dict mapping each input image path to a list of (class_name, filename, crop) tuples,
+    the crops are additionally written to output_dir/<class_name>/ if output_dir is given."""
+    crops = {input_image_path: [] for input_image_path in input_image_paths}
+
+    # Use the TensorRT engine on Nvidia GPUs, plain PyTorch weights otherwise
+    predict_args = {"imgsz": imgsz, "batch": batch_size}
+    if use_engine and torch.cuda.is_available():
+        engine_path = build_engine(model_path, imgsz=imgsz, batch_size=batch_size)
+        if engine_path is not None:
+            model_path = engine_path
+            predict_args.update(half=True, device=0)
+
+    # Load model once, repeated calls reuse the cached instance
+    model = _load_model(model_path)
+
+    # Write the crops in background threads while the next detections are processed
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = {}
+        # Run inference in batches, so that several images share one forward pass
+        for chunk in chunks(list(input_image_paths), batch_size):
+            # Decode every image once with OpenCV, the model and the cropping use the same arrays
+            images = []
+            for input_image_path in chunk:
+                img = cv2.imread(input_image_path)
+                if img is None:
+                    print(f"Warning: Could not load image: {input_image_path}")
+                    continue
+                images.append((input_image_path, img))
+            if not images:
+                continue
+            results = model([img for _, img in images], **predict_args)
 
-    # Run inference
-    results = model(input_image_path)[0]  # First image only (there is only one)
+            for (input_image_path, img), result in zip(images, results):
+                # Alle Detections durchgehen
+                for i, box in enumerate(result.boxes):
+                    cls_id = int(box.cls[0].item())           # Klassennummer
+                    class_name = result.names[cls_id]         # Klassenname (z. B. "blue", "yellow", ...)
+                    conf = float(box.conf[0].item())          # Konfidenz (optional)
+                    xyxy = box.xyxy[0].cpu().numpy().astype(int)  # Bounding Box (x1, y1, x2, y2)
 
-    # Load original image for cropping
-    img = cv2.imread(input_image_path)
+                    x1, y1, x2, y2 = xyxy
+                    # Copy, so the returned crops do not keep the full decoded image alive
+                    crop = img[y1:y2, x1:x2].copy()
 
-    # Alle Detections durchgehen
-    for i, box in enumerate(results.boxes):
-        cls_id = int(box.cls[0].item())           # Klassennummer
-        class_name = results.names[cls_id]        # Klassenname (z. B. "blue", "yellow", ...)
-        conf = float(box.conf[0].item())          # Konfidenz (optional)
-        xyxy = box.xyxy[0].cpu().numpy().astype(int)  # Bounding Box (x1, y1, x2, y2)
+                    filename = f"{Path(input_image_path).stem}_{i}_{class_name}.jpg"
+                    crops[input_image_path].append((class_name, filename, crop))
+                    if output_dir is None:
+                        continue
 
-        x1, y1, x2, y2 = xyxy
-        crop = img[y1:y2, x1:x2]
+                    # Prepare output directory
+                    class_dir = Path(output_dir) / class_name
+                    class_dir.mkdir(parents=True, exist_ok=True)
+                    crop_path = class_dir / filename
 
-        # Prepare output directory
-        class_dir = Path(output_dir) / class_name
-        class_dir.mkdir(parents=True, exist_ok=True)
-        filename = f"{Path(input_image_path).stem}_{i}_{class_name}.jpg"
-        crop_path = class_dir / filename
+                    # Save the crop in the background
+                    futures[executor.submit(cv2.imwrite, str(crop_path), crop)] = crop_path
 
-        # Crop and save
-        cv2.imwrite(str(crop_path), crop)
+        for future in as_completed(futures):
+            if future.result():
+                print(f"Gespeichert: {futures[future]}")
+            else:
+                print(f"Warning: Could not save crop: {futures[future]}")
 
-        print(f"Gespeichert: {crop_path}")
+    return crops
 
 # # Beispielaufruf
 # crop_detections(
 #     model_path="Roboflow/best.pt",
-#     input_image_path="Roboflow/tantrix-extreme.jpg",
+#     input_image_paths=["Roboflow/tantrix-extreme.jpg"],
 #     output_dir="crops"
 # )
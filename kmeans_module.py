@@ -1,13 +1,12 @@
 import cv2
 import numpy as np
-from sklearn.cluster import KMeans
 
-# Reference colors in RGB-format
+# Reference colors in BGR-format (OpenCV channel order, so images need no conversion)
 REFERENCE_COLORS = {
-    1: np.array([12, 108, 217]),   # Blue (#0c6cd9)
-    2: np.array([255, 232, 0]),    # Yellow (#ffe800)
-    3: np.array([215, 31, 43]),    # Red (#d71f2b)
-    4: np.array([0, 161, 69]),     # Green (#00a145)
+    1: np.array([217, 108, 12]),   # Blue (#0c6cd9)
+    2: np.array([0, 232, 255]),    # Yellow (#ffe800)
+    3: np.array([43, 31, 215]),    # Red (#d71f2b)
+    4: np.array([69, 161, 0]),     # Green (#00a145)
 }
 
 COLOR_NAMES = {
@@ -21,11 +20,19 @@ def is_dark(color, threshold=60):
     """Check if the color is classified as black"""
     return np.all(color < threshold)
 
-def cluster_colors(pixels, k=4):
-    """Split the pixel values into k clusters"""
-    kmeans = KMeans(n_clusters=k, n_init='auto', random_state=0).fit(pixels)
-    centers = np.round(kmeans.cluster_centers_).astype(int)
-    return centers, kmeans.labels_
+# Squared color distance thresholds (comparing squared distances avoids the sqrt)
+THRESHOLD_SQ = 30 * 30          # default for compare_colors
+SEGMENT_THRESHOLD_SQ = 35 * 35  # segment colors vs. the center colors
+
+# Stop criteria for cv2.kmeans: 20 iterations or center movement below 1.0
+KMEANS_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 1.0)
+
+def cluster_colors(pixels, k=4, attempts=3):
+    """Split the pixel values into k clusters (OpenCV KMeans in C++)"""
+    cv2.setRNGSeed(0)
+    _, labels, centers = cv2.kmeans(pixels.astype(np.float32), k, None, KMEANS_CRITERIA, attempts, cv2.KMEANS_PP_CENTERS)
+    centers = np.round(centers).astype(int)
+    return centers, labels.ravel()
 
 def get_middle_region(image, percent=0.6):
     """Extract the middle region of the image to eliminate the background color"""
@@ -34,6 +41,10 @@ def get_middle_region(image, percent=0.6):
     dw = int(w * percent / 2)
     return image[h//2 - dh:h//2 + dh, w//2 - dw:w//2 + dw]
 
+def segment_pixels(segment, step=2):
+    """Flatten a segment into a pixel list, keeping only every step-th row and column"""
+    return np.ascontiguousarray(segment[::step, ::step]).reshape(-1, 3)
+
 def split_into_grid(image, rows=3, cols=3):
     """Split the image into a 3x3 grid to analyze the regions further"""
     h, w = image.shape[:2]
@@ -45,56 +56,75 @@ def split_into_grid(image, rows=3, cols=3):
             grid.append(image[y0:y1, x0:x1])
     return grid
 
+def dark_fraction(pixels, threshold=60):
+    """Share of the pixels that are classified as black (an empty segment counts as black)"""
+    if len(pixels) == 0:
+        return 1.0
+    return (pixels < threshold).all(axis=1).mean()
+
+def dominant_color(pixels, min_share=0.9):
+    """Return the mean color of the most frequent 5-bit-per-channel bin if it holds at least min_share of the pixels, else None"""
+    if len(pixels) == 0:
+        return None
+    bins = (pixels >> 3).astype(np.int64) @ np.array([1, 32, 1024])
+    counts = np.bincount(bins, minlength=32 ** 3)
+    mode = counts.argmax()
+    if counts[mode] < min_share * len(pixels):
+        return None
+    return np.round(pixels[bins == mode].mean(axis=0)).astype(int)
+
 def find_best_reference_matches(candidate_colors, reference_colors, top_n=3):
     """Find the 3 colors in the image that match best with the 4 pre-defined Tantrix tile colors"""
-    matches = []
-    for c in candidate_colors:
-        min_dist = float('inf')
-        best_code = None
-        for code, ref in reference_colors.items():
-            dist = np.linalg.norm(c - ref)
-            if dist < min_dist:
-                min_dist = dist
-                best_code = code
-        matches.append((tuple(c), best_code, min_dist))
+    if len(candidate_colors) == 0:
+        return []
+    codes = list(reference_colors.keys())
+    cand = np.asarray(candidate_colors)
+    refs = np.stack(list(reference_colors.values()))
+    # Squared distances of all candidates to all reference colors, shape (N, 4)
+    d2 = ((cand[:, None, :] - refs[None, :, :]) ** 2).sum(-1)
+    best_idx = np.argmin(d2, axis=1)
+    order = np.argsort(d2.min(axis=1), kind="stable")
 
     sorted_matches = []
     used_codes = set()
-    for color, code, dist in sorted(matches, key=lambda x: x[2]):
+    for i in order:
+        code = codes[best_idx[i]]
         if code not in used_codes:
-            sorted_matches.append((np.array(color), code))
+            sorted_matches.append((cand[i], code))
             used_codes.add(code)
         if len(sorted_matches) == top_n:
             break
     return sorted_matches
 
-def compare_colors(base_colors, target_colors, threshold=30):
-    matches = []
-    for tc in target_colors:
-        if is_dark(tc):
-            continue
-        for bc in base_colors:
-            dist = np.linalg.norm(bc - tc)
-            if dist < threshold:
-                matches.append(bc)
-                break
-    return matches
+def compare_colors(base_colors, target_colors, threshold_sq=THRESHOLD_SQ):
+    """Link every non-black target color to the closest base color within the (squared) threshold"""
+    base = np.asarray(base_colors)
+    target = np.asarray(target_colors)
+    if len(base) == 0 or len(target) == 0:
+        return []
+    target = target[~(target < 60).all(axis=1)]
+    # Squared distances of all targets to all base colors, shape (T, B)
+    d2 = ((target[:, None, :] - base[None, :, :]) ** 2).sum(-1)
+    hit = d2.min(axis=1) < threshold_sq
+    return list(base[d2.argmin(axis=1)][hit])
 
 def analyze_image(image_path):
-    """Consider the center of the cropped image and extract dominant colors. 
-    Compute distances of these colors in RGB space to the four predefined Tantrix colors.
-    Select the three image colors that are closest to the reference set and use them further.
-    Define a color map that links the occurring image color tones to the Tantrix colors.
-    Then examine the outer 8 image segments and compare their colors with the three prominent center colors.
-    From that comparison generate a sequence of colors."""
+    """Load a cropped tile image from disk and analyze it with `analyze_image_arr`"""
     image = cv2.imread(image_path)
     if image is None:
         raise FileNotFoundError(f"Bild konnte nicht geladen werden: {image_path}")
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return analyze_image_arr(image)
 
+def analyze_image_arr(image):
+    """Consider the center of the cropped image (BGR array) and extract dominant colors. 
+    Compute distances of these colors in color space (BGR, as loaded by OpenCV) to the four predefined Tantrix colors.
+    Select the three image colors that are closest to the reference set and use them further.
+    Define a color map that links the occurring image color tones to the Tantrix colors.
+    Then examine the outer 8 image segments and compare their colors with the three prominent center colors.
+    From that comparison generate a sequence of colors."""
     # Analyze the center and compare the dominant colors with the 4 Tantrix colors
-    middle = get_middle_region(image_rgb, 0.65)
-    mid_pixels = middle.reshape(-1, 3)
+    middle = get_middle_region(image, 0.65)
+    mid_pixels = segment_pixels(middle)
     mid_centers, _ = cluster_colors(mid_pixels, k=6)
     # Filter out black (background on the tiles)
     candidate_colors = [c for c in mid_centers if not is_dark(c)]
@@ -103,19 +133,30 @@ def analyze_image(image_path):
     best_matches = find_best_reference_matches(candidate_colors, REFERENCE_COLORS, top_n=3)
     allowed_reference_codes = [code for _, code in best_matches]
     color_map = {tuple(c.tolist()): code for c, code in best_matches}
+    best_colors = np.array([c for c, _ in best_matches])
+    best_codes = [code for _, code in best_matches]
 
-    segments = split_into_grid(image_rgb, 3, 3)
+    segments = split_into_grid(image, 3, 3)
     # positions = [0, 1, 2, 5, 8, 7, 6, 3]  # clockwise
     positions = [0, 3, 6, 7, 8, 5, 2, 1]  # counter-clockwise
 
     result = []
     for idx in positions:
         segment = segments[idx]
-        seg_pixels = segment.reshape(-1, 3)
-        # Up to 4 colors per segment: background, black, two Tantrix colors
-        seg_centers, _ = cluster_colors(seg_pixels, k=4)
+        seg_pixels = segment_pixels(segment)
+        # Segments that are (almost) only black background contain no Tantrix color
+        if dark_fraction(seg_pixels) > 0.85:
+            result.append(0)
+            continue
+        # A single dominant color needs no clustering,
+        # otherwise up to 4 colors per segment: background, black, two Tantrix colors
+        dominant = dominant_color(seg_pixels)
+        if dominant is not None:
+            seg_centers = dominant[None, :]
+        else:
+            seg_centers, _ = cluster_colors(seg_pixels, k=4)
         # Compare the colors found in the segment with the center colors and link them
-        matched_colors = compare_colors([c for c, _ in best_matches], seg_centers, threshold=35)
+        matched_colors = compare_colors(best_colors, seg_centers, threshold_sq=SEGMENT_THRESHOLD_SQ)
 
         labels = []
         for c in matched_colors:
@@ -124,15 +165,8 @@ def analyze_image(image_path):
             if c_tuple in color_map:
                 labels.append(color_map[c_tuple])
             else:
-                min_dist = float('inf')
-                best_code = None
-                for ref_c, code in best_matches:
-                    dist = np.linalg.norm(c - ref_c)
-                    if dist < min_dist:
-                        min_dist = dist
-                        best_code = code
-                if best_code:
-                    labels.append(best_code)
+                d2 = ((best_colors - c) ** 2).sum(-1)
+                labels.append(best_codes[d2.argmin()])
 
         if len(labels) == 1:
             result.append(labels[0])
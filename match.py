@@ -1,6 +1,11 @@
-from typing import Union, List, Tuple
+import logging
+from functools import lru_cache
+from itertools import permutations
+from typing import Union, List, Tuple, Dict
 from collections import Counter
 
+log = logging.getLogger(__name__)
+
 # Tantrix helper functions
 
 tiles_complete = ['112323', '212313', '131322', '112332', '131223', '121332', '113232',
@@ -12,53 +17,9 @@ tiles_complete = ['112323', '212313', '131322', '112332', '131223', '121332', '1
                   '112424', '212414', '141422', '112442', '141224', '121442', '114242',
                   '112244', '121424', '114224', '141242', '221441', '114422', '121244']
 
-
-def get_dist(tile, col):
-    """
-    Distance between the two occurrences of a color in a tile encoding.
-    Example: get_dist("121323", 1) returns 2 (distance) and starting index.
-    :param tile: encoding string of a tile
-    :param col: color to search for (as int or value convertible to str)
-    :return: (distance between the two color positions, index of first occurrence)
-    """
-    if str(col) not in tile:
-        return 0, 0
-    indices = []
-    for r in range(6):
-        if tile[r] == str(col):
-            indices.append(r)
-    dist = indices[1] - indices[0]
-    return dist, indices[0]
-
-
-def shift_tile(tile, offset: int):
-    """
-    Shift a tile encoding circularly by offset positions to the left.
-    :param tile: a list (or sequence) with the six color values of the tile
-    :param offset: how many positions to shift (positive = shift left)
-    :return: shifted tile as a new list
-    """
-    return [tile[(i + offset) % 6] for i in range(6)]
-
-
-def sort_sol(tile):
-    """
-    Rotate the tile encoding into a canonical orientation.
-    The function searches for a color j in {1,2,3} whose two occurrences
-    determine the proper rotation and then rotates the tile accordingly.
-
-    :param tile: tile encoding (iterable of length 6)
-    :return: rotated tile (list) in canonical position
-    """
-    for j in range(1, 4):
-        distance, index = get_dist(tile, j)
-        if distance in [1, 2, 4, 5]:
-            if distance < 4:
-                tile = shift_tile(tile, index)
-            else:
-                tile = shift_tile(tile, index + distance)
-            break
-    return tile
+# Every rotation of every tile encoding -> tile number (6 x 56 = 336 entries),
+# so a matched variant can be looked up in whatever rotation it was found.
+TILE_ROTATIONS = {tile[r:] + tile[:r]: i for i, tile in enumerate(tiles_complete) for r in range(6)}
 
 
 # Matching functions
@@ -114,46 +75,13 @@ def preprocess_input(raw_input: List[Union[int, List[int]]]) -> List[List[int]]:
     selected_variants = []
     for variant in compressed_variants:
         c = Counter(variant)
-        # discard variants where any color appears 3 or more times
-        if max(c.values()) < 3:
+        # discard empty variants and variants where any color appears 3 or more times
+        if variant and max(c.values()) < 3:
             selected_variants.append(''.join([str(pos) for pos in variant]))
     return selected_variants
                 
 
 
-def match_pattern(compressed_input: str, pattern: str) -> Union[str, None]:
-    """
-    Attempt to find a unique assignment of variables in `pattern` to the
-    digits in `compressed_input`. If successful, return the expanded tile code
-    string (e.g. '223131' for pattern 'aabcbc'). Otherwise return None.
-
-    :param compressed_input: compressed candidate string (e.g. '23131')
-    :param pattern: compact pattern using letters like 'abcbc', 'abc' etc.
-    :return: expanded tile code string or None
-    """
-    if len(compressed_input) != len(pattern):
-        return None
-
-    mapping = {}
-    used_values = {}
-
-    for char_pat, char_inp in zip(pattern, compressed_input):
-        if char_pat in mapping:
-            if mapping[char_pat] != char_inp:
-                return None  # contradiction
-        else:
-            if char_inp in used_values:
-                return None  # two pattern letters map to the same digit
-            mapping[char_pat] = char_inp
-            used_values[char_inp] = True
-    # Debug prints preserved from original
-    print(f"{mapping=}")
-    print(f"{used_values=}")
-    # Reconstruct the full expanded type string (e.g. 'aabcbc' -> '223131')
-    full_type_expanded = ''.join(mapping[c] for c in expand_pattern(pattern))
-    return full_type_expanded
-
-
 def expand_pattern(pattern: str) -> str:
     """
     Return the expanded version of a compact pattern.
@@ -176,13 +104,44 @@ def rotate_string(s: str, n: int) -> str:
     return s[n:] + s[:n]
 
 
+@lru_cache(maxsize=None)
+def pattern_lookup(pattern: str) -> Dict[str, str]:
+    """
+    Precompute the result of matching every possible compressed input against
+    `pattern`. The keys are all rotations of all color assignments of the
+    pattern, the values are the expanded tile strings that the first matching
+    rotation produces. Built once per pattern and cached.
+
+    :param pattern: compact pattern using letters like 'abcbc', 'abc' etc.
+    :return: dict mapping compressed input strings to expanded tile strings
+    """
+    letters = sorted(set(pattern))
+    expansion = expand_pattern(pattern)
+    expanded_by_compressed = {}
+    for colors in permutations('1234', len(letters)):
+        mapping = dict(zip(letters, colors))
+        compressed = ''.join(mapping[c] for c in pattern)
+        expanded_by_compressed[compressed] = ''.join(mapping[c] for c in expansion)
+
+    lookup = {}
+    for compressed in expanded_by_compressed:
+        for shift in range(len(compressed)):
+            candidate = rotate_string(compressed, shift)
+            for rotation in range(len(candidate)):
+                rotated = rotate_string(candidate, rotation)
+                if rotated in expanded_by_compressed:
+                    lookup[candidate] = expanded_by_compressed[rotated]
+                    break
+    return lookup
+
+
 def find_matching_type(compressed_input: str, input_pattern: str = None) -> Union[Tuple['str', 'str'], None]:
     """
     Try to match a compressed input string against known tile patterns.
     If an explicit input_pattern is provided, only that pattern is tried.
     Otherwise a default set of patterns is attempted.
 
-    The function rotates the input string to account for circular shifts.
+    Circular shifts of the input are covered by the precomputed `pattern_lookup`.
     Returns the matched expanded tile string or None.
     """
     if input_pattern is None:
@@ -191,13 +150,9 @@ def find_matching_type(compressed_input: str, input_pattern: str = None) -> Unio
         known_patterns = [input_pattern]
 
     for pattern in known_patterns:
-        print(f"{pattern=}")
-        for shift in range(len(compressed_input)):
-            rotated = rotate_string(compressed_input, shift)
-            print(f"{rotated=}")
-            match = match_pattern(rotated, pattern)
-            if match:
-                return match
+        match = pattern_lookup(pattern).get(compressed_input)
+        if match:
+            return match
     return None
 
 
@@ -217,24 +172,24 @@ def check_variants(input_variants: List[List[int]], input_pattern: str = None) -
 def get_tile_number(matched_variant: Union[str, None]) -> Union[int, None]:
     """
     Return the index (tile number) of the matched variant within the
-    master list `tiles_complete`. The matched_variant is first
-    standardized (rotated) using `sort_sol` and then looked up.
-    Returns None if matched_variant is None.
+    master list `tiles_complete`. The matched_variant may be in any
+    rotation, all rotations are contained in `TILE_ROTATIONS`.
+    Returns None if matched_variant is None or not a known tile.
     """
     if matched_variant is not None:
-        standardized_format = ''.join(sort_sol(matched_variant))
-        tile_number = tiles_complete.index(standardized_format)
-        print(f"{tile_number=}")
+        tile_number = TILE_ROTATIONS.get(matched_variant)
+        log.debug("tile_number=%r", tile_number)
         return tile_number
     return None
 
 
 def main():
+    logging.basicConfig(level=logging.WARNING)
     variants = preprocess_input([3, [4, 3], 3, 1, 0, [4, 1], 1, [4, 3]])
     print(f"{variants=}")
     out = check_variants(variants, input_pattern='abacbc')
     print(f"{out=}")
-    get_tile_number(out)
+    print(f"tile_number={get_tile_number(out)}")
     
 if __name__ == "__main__":
     main()
@@ -1,4 +1,11 @@
+import torch
 from ultralytics import YOLO
 
-model = YOLO("Roboflow/best.pt")
+from image_input import build_engine
+
+model_path = "Roboflow/best.pt"
+if torch.cuda.is_available():
+    model_path = build_engine(model_path) or model_path  # TensorRT FP16 engine, built once and cached
+
+model = YOLO(model_path)
 results = model("Roboflow/tantrix-extreme.jpg", save=True)